@@ -1,8 +1,12 @@
 import streamlit as st
 import io
+import gc
+import re
 import zipfile
+import hashlib
 from datetime import datetime
 from collections import Counter
+from functools import lru_cache
 
 # Configuración debe ser PRIMERO
 st.set_page_config(
@@ -40,71 +44,111 @@ def mm_to_points(mm):
 # Convertir a puntos para PyPDF
 PAPER_SIZES = {k: (mm_to_points(v[0]), mm_to_points(v[1])) for k, v in PAPER_SIZES_MM.items()}
 
-# Función para detectar el tamaño óptimo
-def detect_optimal_size(uploaded_files):
-    """Detecta el tamaño que mejor se adapta a todas las páginas"""
-    all_sizes = []
-    
-    for file in uploaded_files:
-        try:
-            file.seek(0)
-            doc = fitz.open(stream=file.read(), filetype="pdf")
-            
-            for page in doc:
-                rect = page.rect
-                width = rect.width
-                height = rect.height
-                all_sizes.append((width, height))
-            
-            doc.close()
-                
-        except Exception:
-            continue
-    
-    if not all_sizes:
-        return PAPER_SIZES["A4"]
-    
-    # Encontrar el tamaño más común
-    size_counter = Counter(all_sizes)
-    most_common_size = size_counter.most_common(1)[0][0]
-    
-    # Buscar el tamaño estándar más cercano
-    best_match = PAPER_SIZES["A4"]
+# Nombre de cada tamaño estándar a partir de sus dimensiones en puntos
+PAPER_SIZE_NAMES = {v: k for k, v in PAPER_SIZES.items()}
+
+def _build_size_lookup():
+    """Tamaños estándar candidatos para cada (ancho, alto) redondeado a puntos enteros"""
+    # Cualquier tamaño a menos de 10 pt de uno estándar cae, redondeado, a 10 o menos
+    # de su versión redondeada; el orden de PAPER_SIZES se conserva en cada lista
+    lookup = {}
+    for name, (std_width, std_height) in PAPER_SIZES.items():
+        for dx in range(-10, 11):
+            for dy in range(-10, 11):
+                lookup.setdefault((round(std_width) + dx, round(std_height) + dy), []).append(name)
+    return lookup
+
+_SIZE_LOOKUP = _build_size_lookup()
+
+# Páginas por archivo al dividir en bloques
+BATCH_SIZE = 32
+
+# Por encima de este número de partes solo se ofrece la descarga en ZIP
+MAX_INDIVIDUAL_DOWNLOADS = 5
+
+# Función para leer una única vez la estructura de cada PDF subido
+@st.cache_data(show_spinner=False)
+def _read_pdf_bytes(name, size, digest, _data):
+    """Extrae los tamaños de página de un PDF (cacheado por nombre, tamaño y hash)"""
+    doc = fitz.open(stream=_data, filetype="pdf")
+    page_sizes = [(page.rect.width, page.rect.height) for page in doc]
+    doc.close()
+    return page_sizes, len(page_sizes)
+
+def file_digest(file):
+    """Hash del contenido de un archivo subido (se calcula una sola vez por subida)"""
+    file_id = getattr(file, "file_id", None)
+    digests = st.session_state.setdefault("file_digests", {})
+    if file_id not in digests:
+        digest = hashlib.blake2b(file.getvalue(), digest_size=8).hexdigest()
+        if file_id is None:
+            return digest
+        digests[file_id] = digest
+    return digests[file_id]
+
+def read_pdf_info(file):
+    """Devuelve (tamaños de página, total de páginas) de un archivo subido"""
+    return _read_pdf_bytes(file.name, file.size, file_digest(file), file.getvalue())
+
+# Función para buscar el tamaño estándar más cercano (el mismo tamaño se repite entre reruns)
+@lru_cache(maxsize=256)
+def find_closest_paper_size(width, height):
+    """Devuelve el nombre del tamaño estándar más cercano a (width, height)"""
+    best_match = "A4"
     min_diff = float('inf')
     
     for name, std_size in PAPER_SIZES.items():
-        diff = abs(std_size[0] - most_common_size[0]) + abs(std_size[1] - most_common_size[1])
+        diff = abs(std_size[0] - width) + abs(std_size[1] - height)
         if diff < min_diff:
             min_diff = diff
-            best_match = std_size
+            best_match = name
     
     return best_match
 
+# Función para obtener el nombre de un tamaño (tolerancia de 10 puntos)
+def paper_size_name(width, height):
+    """Devuelve el nombre del primer tamaño estándar a menos de 10 pt, o Personalizado"""
+    for name in _SIZE_LOOKUP.get((round(width), round(height)), ()):
+        std_width, std_height = PAPER_SIZES[name]
+        if abs(width - std_width) < 10 and abs(height - std_height) < 10:
+            return name
+    return "Personalizado"
+
+# Función para detectar el tamaño óptimo
+def detect_optimal_size(size_counts):
+    """Detecta el tamaño que mejor se adapta a todas las páginas a partir de su distribución"""
+    if not size_counts:
+        return PAPER_SIZES["A4"]
+    
+    # Encontrar el tamaño más común (reutiliza el conteo del análisis, sin otra pasada)
+    most_common_size = max(size_counts, key=size_counts.get)
+    
+    # Buscar el tamaño estándar más cercano
+    return PAPER_SIZES[find_closest_paper_size(*most_common_size)]
+
+# Función para comprobar si una página ya tiene el tamaño objetivo
+def matches_target_size(rect, target_size):
+    """Indica si el rectángulo coincide con el tamaño objetivo (tolerancia de 0.5 pt)"""
+    return abs(rect.width - target_size[0]) < 0.5 and abs(rect.height - target_size[1]) < 0.5
+
 # Función MEJORADA usando PyMuPDF para reescalado
-def resize_page_pymupdf(pdf_file, page_num, target_size):
-    """Reescala página usando PyMuPDF (mucho más robusto)"""
+def resize_page_pymupdf(src_doc, page_num, original_rect, target_size, out_doc):
+    """Reescala una página de src_doc y la añade a out_doc (sin reabrir ni re-serializar)"""
+    # Dimensiones objetivo
+    target_width, target_height = target_size
+    
+    # Dimensiones originales (el llamador ya tiene el rectángulo de la página)
+    original_width = original_rect.width
+    original_height = original_rect.height
+    
+    new_page = out_doc.new_page(width=target_width, height=target_height)
+    
     try:
-        pdf_file.seek(0)
-        doc = fitz.open(stream=pdf_file.read(), filetype="pdf")
-        page = doc[page_num]
-        
-        # Obtener dimensiones originales
-        original_rect = page.rect
-        original_width = original_rect.width
-        original_height = original_rect.height
-        
-        # Dimensiones objetivo
-        target_width, target_height = target_size
-        
         # Calcular escala manteniendo relación de aspecto
         scale_x = target_width / original_width
         scale_y = target_height / original_height
         scale = min(scale_x, scale_y)
         
-        # Crear nueva página
-        new_doc = fitz.open()
-        new_page = new_doc.new_page(width=target_width, height=target_height)
-        
         # Calcular posición para centrar
         scaled_width = original_width * scale
         scaled_height = original_height * scale
@@ -115,117 +159,138 @@ def resize_page_pymupdf(pdf_file, page_num, target_size):
         rect = fitz.Rect(x_offset, y_offset, x_offset + scaled_width, y_offset + scaled_height)
         
         # Mostrar la página original en el nuevo documento
-        new_page.show_pdf_page(rect, doc, page_num)
-        
-        # Guardar en buffer
-        buffer = io.BytesIO()
-        new_doc.save(buffer)
-        new_doc.close()
-        doc.close()
-        
-        buffer.seek(0)
-        return buffer
+        new_page.show_pdf_page(rect, src_doc, page_num)
         
     except Exception as e:
         st.warning(f"Error reescalando página {page_num + 1}: {e}")
-        # Fallback: devolver página sin cambios
-        pdf_file.seek(0)
-        doc = fitz.open(stream=pdf_file.read(), filetype="pdf")
-        new_doc = fitz.open()
-        new_page = new_doc.new_page(width=target_size[0], height=target_size[1])
-        new_page.show_pdf_page(new_page.rect, doc, page_num)
-        buffer = io.BytesIO()
-        new_doc.save(buffer)
-        new_doc.close()
-        doc.close()
-        buffer.seek(0)
-        return buffer
+        # Fallback: mostrar la página ocupando toda la hoja
+        new_page.show_pdf_page(new_page.rect, src_doc, page_num)
+    
+    return new_page
 
 # Función para procesar un PDF individual
-def process_single_pdf(pdf_file, pages_to_remove, target_size):
-    """Procesa un PDF individual: elimina páginas y reescala"""
+def process_single_pdf(src_doc, pages_to_remove, target_size, out_doc):
+    """Procesa un PDF ya abierto: elimina páginas y añade las reescaladas a out_doc"""
     try:
-        pdf_file.seek(0)
-        total_pages = len(PdfReader(pdf_file).pages)
+        total_pages = src_doc.page_count
         pages_to_keep = [i for i in range(total_pages) if i not in pages_to_remove]
         
-        processed_pages = []
-        
-        for page_num in pages_to_keep:
-            pdf_file.seek(0)
-            resized_buffer = resize_page_pymupdf(pdf_file, page_num, target_size)
-            processed_pages.append(resized_buffer)
-        
-        # Combinar páginas procesadas usando PdfWriter
-        if processed_pages:
-            writer = PdfWriter()
-            for buffer in processed_pages:
-                buffer.seek(0)
-                reader = PdfReader(buffer)
-                for page in reader.pages:
-                    writer.add_page(page)
+        if pages_to_keep:
+            # Las páginas consecutivas que ya tienen el tamaño objetivo se copian en
+            # bloque con una sola llamada a insert_pdf; el resto se reescala una a una.
+            # final=0 conserva el mapa de objetos copiados: si no, cada bloque duplicaría fuentes e imágenes
+            run_start = run_end = None
+            for page_num in pages_to_keep:
+                page_rect = src_doc[page_num].rect
+                if matches_target_size(page_rect, target_size):
+                    if run_end is not None and page_num == run_end + 1:
+                        run_end = page_num
+                        continue
+                    if run_start is not None:
+                        out_doc.insert_pdf(src_doc, from_page=run_start, to_page=run_end, final=0)
+                    run_start = run_end = page_num
+                else:
+                    if run_start is not None:
+                        out_doc.insert_pdf(src_doc, from_page=run_start, to_page=run_end, final=0)
+                        run_start = run_end = None
+                    resize_page_pymupdf(src_doc, page_num, page_rect, target_size, out_doc)
             
-            final_buffer = io.BytesIO()
-            writer.write(final_buffer)
-            final_buffer.seek(0)
+            if run_start is not None:
+                out_doc.insert_pdf(src_doc, from_page=run_start, to_page=run_end, final=0)
             
-            return final_buffer, total_pages, len(pages_to_keep)
+            return total_pages, len(pages_to_keep)
         else:
             raise Exception("No se procesaron páginas")
         
     except Exception as e:
         raise Exception(f"Error procesando PDF: {str(e)}")
 
-# Función para unir PDFs
-def merge_processed_pdfs(processed_pdfs):
-    """Une múltiples PDFs en uno solo"""
+# Función para comprobar si un PDF tiene anotaciones (incluidos enlaces y campos)
+def has_annotations(doc):
+    """Indica si alguna página del documento tiene entradas en /Annots"""
+    return any(doc.page_annot_xrefs(page_num) for page_num in range(doc.page_count))
+
+# Función para reescalar y unir PDFs en una sola pasada
+def build_merged(jobs, target_size, on_progress=None):
+    """Reescala y une una lista de (archivo, páginas a eliminar) en un único documento"""
+    out_doc = fitz.open()
+    
+    # Los archivos idénticos (mismo hash) comparten documento de origen: así PyMuPDF
+    # reutiliza las páginas y recursos ya copiados en lugar de duplicarlos
+    digests = [file_digest(pdf_file) for pdf_file, _ in jobs]
+    pending = Counter(digests)
+    src_docs = {}
+    # Salvo si tienen anotaciones o campos: compartirlos haría que dos páginas apunten
+    # a la misma anotación, así que esos se reabren en cada archivo
+    unshared = set()
+    
     try:
-        writer = PdfWriter()
-        
-        for pdf_buffer in processed_pdfs:
-            pdf_buffer.seek(0)
-            reader = PdfReader(pdf_buffer)
-            for page in reader.pages:
-                writer.add_page(page)
+        results = []
+        for i, ((pdf_file, pages_to_remove), digest) in enumerate(zip(jobs, digests)):
+            if digest not in src_docs:
+                try:
+                    src_docs[digest] = fitz.open(stream=pdf_file.getvalue(), filetype="pdf")
+                except Exception as e:
+                    raise Exception(f"Error procesando PDF: {str(e)}")
+                
+                if pending[digest] > 1 and has_annotations(src_docs[digest]):
+                    unshared.add(digest)
+            
+            results.append(process_single_pdf(src_docs[digest], pages_to_remove, target_size, out_doc))
+            
+            # Cerrar el original en cuanto ningún otro archivo lo necesita
+            pending[digest] -= 1
+            if not pending[digest] or digest in unshared:
+                src_docs.pop(digest).close()
+            
+            if on_progress:
+                on_progress((i + 1) / len(jobs))
         
-        merged_buffer = io.BytesIO()
-        writer.write(merged_buffer)
-        merged_buffer.seek(0)
+        try:
+            merged_buffer = io.BytesIO()
+            # Comprimir los flujos sin comprimir y agrupar objetos en object streams:
+            # salida más pequeña sin el coste de garbage=3 (que re-escanea todo el documento)
+            out_doc.save(merged_buffer, deflate=True, use_objstms=1)
+            merged_buffer.seek(0)
+        except Exception as e:
+            raise Exception(f"Error uniendo PDFs: {str(e)}")
         
-        return merged_buffer
-    except Exception as e:
-        raise Exception(f"Error uniendo PDFs: {str(e)}")
+        return merged_buffer, results
+    finally:
+        for src_doc in src_docs.values():
+            src_doc.close()
+        out_doc.close()
 
-# Función para parsear páginas a eliminar
+# Páginas sueltas ("3") o rangos ("5-7") separados por comas; el resto se ignora.
+# Los números admiten lo mismo que int(): signo "+" y guiones bajos ("+4", "1_0")
+_PAGES_RE = re.compile(r'(?:^|,)\s*(\+?\d+(?:_\d+)*)\s*(?:-\s*(\+?\d+(?:_\d+)*)\s*)?(?=,|$)')
+
+# Una línea de rango para dividir: página suelta ("3") o rango ("1-5"), con los mismos números que _PAGES_RE
+_RANGE_RE = re.compile(r'^\s*(\+?\d+(?:_\d+)*)\s*(?:-\s*(\+?\d+(?:_\d+)*)\s*)?$')
+
+# Función para parsear páginas a eliminar (memoizada: se llama en cada rerun con el mismo texto)
+@lru_cache(maxsize=256)
 def parse_pages_input(pages_input, total_pages=None):
-    """Convierte texto de páginas a eliminar en conjunto de números"""
+    """Convierte texto de páginas a eliminar en conjunto inmutable de números"""
     pages_to_remove = set()
     if not pages_input or not pages_input.strip():
-        return pages_to_remove
-    
-    parts = pages_input.split(',')
+        return frozenset(pages_to_remove)
     
-    for part in parts:
-        part = part.strip()
-        if '-' in part:
-            try:
-                start, end = map(int, part.split('-'))
-                start_idx = max(0, start - 1)
-                end_idx = end
-                if total_pages:
-                    end_idx = min(end_idx, total_pages)
-                pages_to_remove.update(range(start_idx, end_idx))
-            except ValueError:
-                continue
+    # Una sola pasada del motor de regex en lugar de split/strip/int por cada parte
+    for match in _PAGES_RE.finditer(pages_input):
+        start, end = match.groups()
+        if end is not None:
+            start_idx = max(0, int(start) - 1)
+            end_idx = int(end)
+            if total_pages:
+                end_idx = min(end_idx, total_pages)
+            pages_to_remove.update(range(start_idx, end_idx))
         else:
-            try:
-                page_num = int(part) - 1
-                if total_pages is None or (0 <= page_num < total_pages):
-                    pages_to_remove.add(page_num)
-            except ValueError:
-                continue
+            page_num = int(start) - 1
+            if total_pages is None or (0 <= page_num < total_pages):
+                pages_to_remove.add(page_num)
     
-    return pages_to_remove
+    return frozenset(pages_to_remove)
 
 # Función para analizar la distribución de tamaños
 def analyze_size_distribution(uploaded_files):
@@ -241,26 +306,19 @@ def analyze_size_distribution(uploaded_files):
     
     for file in uploaded_files:
         try:
-            file.seek(0)
-            doc = fitz.open(stream=file.read(), filetype="pdf")
-            file_sizes = []
+            page_sizes, total_pages = read_pdf_info(file)
+            file_sizes = [(round(width, 1), round(height, 1)) for width, height in page_sizes]
             
-            for page in doc:
-                rect = page.rect
-                width = round(rect.width, 1)
-                height = round(rect.height, 1)
-                file_sizes.append((width, height))
-                size_analysis['summary']['total_pages'] += 1
-                size_analysis['summary']['unique_sizes'].add((width, height))
-                size_analysis['summary']['size_counts'][(width, height)] += 1
+            # Acumular por archivo completo: el conteo lo hace Counter.update en C
+            size_analysis['summary']['total_pages'] += len(file_sizes)
+            size_analysis['summary']['unique_sizes'].update(file_sizes)
+            size_analysis['summary']['size_counts'].update(file_sizes)
             
             size_analysis['files'][file.name] = {
                 'sizes': file_sizes,
-                'total_pages': len(doc)
+                'total_pages': total_pages
             }
             
-            doc.close()
-            
         except Exception as e:
             size_analysis['files'][file.name] = {'error': str(e)}
     
@@ -300,66 +358,158 @@ def display_size_analysis(analysis, target_size):
         margin_y = (target_height - final_height) / 2
         
         # Encontrar nombre del tamaño
-        size_name = "Personalizado"
-        for name, std_size in PAPER_SIZES.items():
-            if abs(width - std_size[0]) < 10 and abs(height - std_size[1]) < 10:
-                size_name = name
-                break
+        size_name = paper_size_name(width, height)
         
         st.write(f"- **{size_name}** ({width:.0f} × {height:.0f} pts): {count} páginas")
         if margin_x > 0 or margin_y > 0:
             st.write(f"  → Escala: {scale:.2f}x, Márgenes: {margin_x:.1f} × {margin_y:.1f} pts")
 
+# Función para serializar una parte de la división
+def _render_split_output(pdf_writer, buffer):
+    """Escribe un PdfWriter en un buffer reutilizable y devuelve sus bytes"""
+    buffer.seek(0)
+    buffer.truncate(0)
+    pdf_writer.write(buffer)
+    return buffer.getvalue()
+
 # Función para dividir PDF
-def split_pdf(pdf_file, split_option, custom_ranges=None):
-    """Divide un PDF en múltiples archivos"""
+def split_pdf(pdf_data, split_option, custom_ranges, batch_size=BATCH_SIZE):
+    """Divide un PDF generando cada parte como (nombre, bytes) en lugar de acumularlas"""
     try:
-        pdf_file.seek(0)
-        pdf_reader = PdfReader(pdf_file)
-        total_pages = len(pdf_reader.pages)
-        pdf_files = []
+        # Parsear desde los bytes del archivo (sin seek sobre el upload)
+        pdf_reader = PdfReader(io.BytesIO(pdf_data))
+        # Enlazar la lista de páginas una sola vez (cada acceso a .pages crea una vista nueva)
+        pages = pdf_reader.pages
+        total_pages = len(pages)
+        
+        # Un único buffer de trabajo para todas las partes (cada parte sale como copia en bytes)
+        buffer = io.BytesIO()
         
         if split_option == "todas":
             for page_num in range(total_pages):
                 pdf_writer = PdfWriter()
-                pdf_writer.add_page(pdf_reader.pages[page_num])
+                pdf_writer.add_page(pages[page_num])
                 
-                buffer = io.BytesIO()
-                pdf_writer.write(buffer)
-                buffer.seek(0)
-                pdf_files.append(buffer)
+                yield f"pagina_{page_num + 1}.pdf", _render_split_output(pdf_writer, buffer)
+        
+        elif split_option == "bloques":
+            # Un solo PdfWriter por bloque: los recursos compartidos se serializan una vez por bloque
+            for start in range(0, total_pages, batch_size):
+                end = min(start + batch_size, total_pages)
+                pdf_writer = PdfWriter()
+                for page_num in range(start, end):
+                    pdf_writer.add_page(pages[page_num])
+                
+                yield f"paginas_{start + 1}_a_{end}.pdf", _render_split_output(pdf_writer, buffer)
         
         elif split_option == "rango_personalizado" and custom_ranges:
             for range_str in custom_ranges:
+                match = _RANGE_RE.match(range_str)
+                if not match:
+                    continue
+                
                 pdf_writer = PdfWriter()
+                start, end = match.groups()
+                start = max(1, int(start)) - 1
+                end = min(total_pages, int(end or match.group(1)))
                 
-                if '-' in range_str:
-                    try:
-                        start, end = map(int, range_str.split('-'))
-                        start = max(1, start) - 1
-                        end = min(total_pages, end)
-                        
-                        for page_num in range(start, end):
-                            pdf_writer.add_page(pdf_reader.pages[page_num])
-                    except ValueError:
-                        continue
-                else:
-                    try:
-                        page_num = int(range_str) - 1
-                        if 0 <= page_num < total_pages:
-                            pdf_writer.add_page(pdf_reader.pages[page_num])
-                    except ValueError:
-                        continue
+                for page_num in range(start, end):
+                    pdf_writer.add_page(pages[page_num])
                 
-                buffer = io.BytesIO()
-                pdf_writer.write(buffer)
-                buffer.seek(0)
-                pdf_files.append(buffer)
+                yield f"rango_{range_str}.pdf".replace('-', '_'), _render_split_output(pdf_writer, buffer)
         
-        return pdf_files
     except Exception as e:
         raise Exception(f"Error dividiendo PDF: {str(e)}")
 
+# Función para dividir un PDF y empaquetarlo en ZIP
+def build_split(pdf_data, split_option, custom_ranges, batch_size):
+    """Divide un PDF y devuelve (buffer del zip, partes con botón propio, estadísticas)"""
+    # Cada parte se escribe en el ZIP según se genera; solo se conservan
+    # en memoria si van a tener su propio botón de descarga
+    pdf_files = []
+    split_stats = {'files': 0, 'size': 0}
+    zip_buffer = io.BytesIO()
+    # Nivel 1: pypdf puede dejar flujos sin comprimir, así que no se
+    # renuncia a DEFLATE, pero se usa el nivel más rápido
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zip_file:
+        for filename, data in split_pdf(pdf_data, split_option, custom_ranges, batch_size):
+            zip_file.writestr(filename, data)
+            split_stats['files'] += 1
+            split_stats['size'] += len(data)
+            if split_stats['files'] <= MAX_INDIVIDUAL_DOWNLOADS:
+                pdf_files.append((filename, data))
+            else:
+                pdf_files.clear()
+    
+    # Liberar los PdfWriter intermedios (pypdf crea ciclos de referencias)
+    gc.collect()
+    
+    return zip_buffer, pdf_files, split_stats
+
+# Función para mostrar las descargas de la división (fragmento: un clic en
+# descargar solo vuelve a ejecutar este bloque, no toda la aplicación)
+@st.fragment
+def render_split_downloads(zip_buffer, pdf_files, split_stats, split_option, batch_size, ranges_list, total_pages):
+    """Muestra el botón del ZIP y, si hay pocas partes, una descarga por archivo"""
+    # Descarga en ZIP
+    if split_stats['files'] > 1:
+        st.subheader("📦 Descarga múltiple")
+        
+        zip_size = zip_buffer.getbuffer().nbytes / 1024
+        
+        st.download_button(
+            label=f"📥 Descargar todos como ZIP ({zip_size:.1f} KB)",
+            data=zip_buffer,
+            file_name="pdf_divididos.zip",
+            mime="application/zip",
+            type="primary"
+        )
+    
+    # Descargas individuales
+    if split_stats['files'] > MAX_INDIVIDUAL_DOWNLOADS:
+        st.info(f"ℹ️ Con más de {MAX_INDIVIDUAL_DOWNLOADS} archivos solo está disponible la descarga en ZIP")
+    else:
+        st.subheader("📄 Descargas individuales")
+        
+        if split_option == "todas":
+            pages_per_row = 6
+            total_pages_display = len(pdf_files)
+            
+            for start_idx in range(0, total_pages_display, pages_per_row):
+                end_idx = min(start_idx + pages_per_row, total_pages_display)
+                cols = st.columns(pages_per_row)
+                
+                for i, (filename, data) in enumerate(pdf_files[start_idx:end_idx]):
+                    page_num = start_idx + i + 1
+                    with cols[i]:
+                        st.download_button(
+                            label=f"Pág {page_num}",
+                            data=data,
+                            file_name=filename,
+                            mime="application/pdf",
+                            key=f"page_{page_num}",
+                            use_container_width=True
+                        )
+        else:
+            cols = st.columns(2)
+            for i, (filename, data) in enumerate(pdf_files):
+                if split_option == "bloques":
+                    start = i * batch_size + 1
+                    range_name = f"{start}-{min(start + batch_size - 1, total_pages)}"
+                else:
+                    range_name = ranges_list[i] if i < len(ranges_list) else f"rango_{i+1}"
+                file_size = len(data) / 1024
+                
+                with cols[i % 2]:
+                    st.download_button(
+                        label=f"📑 {range_name} ({file_size:.1f} KB)",
+                        data=data,
+                        file_name=filename,
+                        mime="application/pdf",
+                        key=f"range_{i}",
+                        use_container_width=True
+                    )
+
 # Interfaz principal
 def main():
     st.title("📄 PDF Toolkit - Unir y Reescalar PDFs")
@@ -408,13 +558,13 @@ def main():
         )
         
         if uploaded_files:
+            # Analizar los tamaños una sola vez: sirve para detectar y para mostrar
+            size_analysis = analyze_size_distribution(uploaded_files)
+            
             # Detectar tamaño objetivo
             if target_size is None:
-                detected_size = detect_optimal_size(uploaded_files)
-                target_size_name = [k for k, v in PAPER_SIZES.items() if v == detected_size][0]
-                target_size = detected_size
-            else:
-                target_size_name = [k for k, v in PAPER_SIZES.items() if v == target_size][0]
+                target_size = detect_optimal_size(size_analysis['summary']['size_counts'])
+                target_size_name = PAPER_SIZE_NAMES[target_size]
             
             target_width, target_height = target_size
             
@@ -423,13 +573,10 @@ def main():
             st.info(f"**Dimensiones:** {target_width:.0f} × {target_height:.0f} puntos")
             
             # Convertir a mm para mostrar
-            for name, mm_size in PAPER_SIZES_MM.items():
-                if name == target_size_name:
-                    st.info(f"**En milímetros:** {mm_size[0]} × {mm_size[1]} mm")
-                    break
+            mm_size = PAPER_SIZES_MM[target_size_name]
+            st.info(f"**En milímetros:** {mm_size[0]} × {mm_size[1]} mm")
             
             # Análisis detallado
-            size_analysis = analyze_size_distribution(uploaded_files)
             display_size_analysis(size_analysis, target_size)
             
             st.subheader("📋 Configurar páginas a eliminar")
@@ -437,12 +584,16 @@ def main():
             if 'pages_inputs' not in st.session_state:
                 st.session_state.pages_inputs = {}
             
+            # Olvidar las páginas a eliminar de archivos que ya no están subidos
+            current_keys = {f"pages_{i}_{file.name}" for i, file in enumerate(uploaded_files)}
+            for key in list(st.session_state.pages_inputs):
+                if key not in current_keys:
+                    del st.session_state.pages_inputs[key]
+            
             # Configuración por archivo
             for i, file in enumerate(uploaded_files):
                 try:
-                    file.seek(0)
-                    pdf_reader = PdfReader(file)
-                    total_pages = len(pdf_reader.pages)
+                    _, total_pages = read_pdf_info(file)
                     
                     with st.expander(f"📄 {file.name} ({total_pages} páginas)", expanded=True):
                         col1, col2 = st.columns([2, 1])
@@ -476,7 +627,6 @@ def main():
             if st.button("🔄 Procesar y Unir PDFs", type="primary", key="merge_button"):
                 try:
                     with st.spinner("Reescalando páginas con PyMuPDF..."):
-                        processed_pdfs = []
                         total_stats = {
                             'original_pages': 0,
                             'removed_pages': 0,
@@ -486,31 +636,23 @@ def main():
                         
                         # Barra de progreso
                         progress_bar = st.progress(0)
-                        total_files = len(uploaded_files)
                         
-                        # Procesar cada PDF
+                        # Páginas a eliminar de cada PDF
+                        jobs = []
                         for i, file in enumerate(uploaded_files):
-                            file.seek(0)
-                            
                             key = f"pages_{i}_{file.name}"
                             pages_input = st.session_state.pages_inputs.get(key, "")
-                            pages_to_remove = parse_pages_input(pages_input)
-                            
-                            processed_pdf, original_pages, final_pages = process_single_pdf(
-                                file, pages_to_remove, target_size
-                            )
-                            
-                            processed_pdfs.append(processed_pdf)
+                            _, total_pages = read_pdf_info(file)
+                            jobs.append((file, parse_pages_input(pages_input, total_pages)))
+                        
+                        # Reescalar y unir todo en un único documento
+                        final_pdf, results = build_merged(jobs, target_size, progress_bar.progress)
+                        
+                        for (file, pages_to_remove), (original_pages, final_pages) in zip(jobs, results):
                             total_stats['original_pages'] += original_pages
                             total_stats['removed_pages'] += len(pages_to_remove)
                             total_stats['final_pages'] += final_pages
                             total_stats['processed_files'] += 1
-                            
-                            # Actualizar barra de progreso
-                            progress_bar.progress((i + 1) / total_files)
-                        
-                        # Unir PDFs procesados
-                        final_pdf = merge_processed_pdfs(processed_pdfs)
                         
                         # Mostrar resultados
                         st.success("✅ PDFs reescalados y unidos correctamente!")
@@ -535,7 +677,7 @@ def main():
                         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                         st.download_button(
                             label="📥 Descargar PDF Procesado",
-                            data=final_pdf.getvalue(),
+                            data=final_pdf,
                             file_name=f"pdf_reescalado_{timestamp}.pdf",
                             mime="application/pdf",
                             type="primary"
@@ -553,11 +695,25 @@ def main():
             key="split_uploader"
         )
         
+        # Olvidar los hashes de archivos que ya no están subidos en ninguna de las pestañas
+        # (aquí se conocen ya los dos uploaders)
+        live_ids = {file.file_id for file in uploaded_files or []}
+        if uploaded_file_split:
+            live_ids.add(uploaded_file_split.file_id)
+        file_digests = st.session_state.get("file_digests", {})
+        for file_id in list(file_digests):
+            if file_id not in live_ids:
+                del file_digests[file_id]
+
+        # Soltar la última división si su archivo ya no está subido o se ha cambiado por otro
+        last_split = st.session_state.get("last_split")
+        if last_split and (not uploaded_file_split or file_digest(uploaded_file_split) != last_split[0][0]):
+            del st.session_state["last_split"]
+
         if uploaded_file_split:
             try:
-                uploaded_file_split.seek(0)
-                pdf_reader = PdfReader(uploaded_file_split)
-                total_pages = len(pdf_reader.pages)
+                # El número de páginas sale de la caché de metadatos, sin volver a parsear en cada rerun
+                _, total_pages = read_pdf_info(uploaded_file_split)
                 
                 # Mostrar información del PDF
                 col1, col2, col3 = st.columns(3)
@@ -566,15 +722,30 @@ def main():
                 with col2:
                     st.metric("📑 Total páginas", total_pages)
                 with col3:
-                    file_size = len(uploaded_file_split.getvalue()) / 1024
+                    file_size = uploaded_file_split.size / 1024
                     st.metric("📊 Tamaño", f"{file_size:.1f} KB")
                 
+                split_labels = {
+                    "todas": "📄 Dividir en páginas individuales",
+                    "bloques": "📚 Dividir en bloques de páginas",
+                    "rango_personalizado": "🎯 Dividir por rangos personalizados"
+                }
                 split_option = st.radio(
                     "Selecciona cómo quieres dividir el PDF:",
-                    ["todas", "rango_personalizado"],
-                    format_func=lambda x: "📄 Dividir en páginas individuales" if x == "todas" else "🎯 Dividir por rangos personalizados"
+                    list(split_labels.keys()),
+                    format_func=lambda x: split_labels[x]
                 )
                 
+                batch_size = BATCH_SIZE
+                if split_option == "bloques":
+                    batch_size = st.number_input(
+                        "Páginas por archivo:",
+                        min_value=1,
+                        max_value=max(1, total_pages),
+                        value=min(BATCH_SIZE, max(1, total_pages)),
+                        help="Cada bloque de páginas consecutivas creará un PDF separado"
+                    )
+                
                 if split_option == "rango_personalizado":
                     st.subheader("🎯 Configurar rangos de división")
                     
@@ -601,23 +772,23 @@ def main():
                         invalid_ranges = []
                         
                         for range_str in ranges_list:
-                            if '-' in range_str:
-                                try:
-                                    start, end = map(int, range_str.split('-'))
-                                    if 1 <= start <= end <= total_pages:
-                                        valid_ranges.append(f"{start}-{end}")
-                                    else:
-                                        invalid_ranges.append(range_str)
-                                except ValueError:
+                            match = _RANGE_RE.match(range_str)
+                            if not match:
+                                invalid_ranges.append(range_str)
+                                continue
+                            
+                            start, end = match.groups()
+                            if end is not None:
+                                start, end = int(start), int(end)
+                                if 1 <= start <= end <= total_pages:
+                                    valid_ranges.append(f"{start}-{end}")
+                                else:
                                     invalid_ranges.append(range_str)
                             else:
-                                try:
-                                    page_num = int(range_str)
-                                    if 1 <= page_num <= total_pages:
-                                        valid_ranges.append(str(page_num))
-                                    else:
-                                        invalid_ranges.append(range_str)
-                                except ValueError:
+                                page_num = int(start)
+                                if 1 <= page_num <= total_pages:
+                                    valid_ranges.append(str(page_num))
+                                else:
                                     invalid_ranges.append(range_str)
                         
                         # Mostrar validación
@@ -642,90 +813,42 @@ def main():
                     
                     try:
                         with st.spinner("Dividiendo PDF..."):
-                            pdf_files = split_pdf(uploaded_file_split, split_option, ranges_list)
+                            # Repetir la división con el mismo archivo y opciones reutiliza el
+                            # resultado; solo se guarda la última división de cada sesión
+                            split_key = (file_digest(uploaded_file_split), split_option, tuple(ranges_list or ()), batch_size)
+                            last_split = st.session_state.get("last_split")
+                            if last_split is None or last_split[0] != split_key:
+                                st.session_state.last_split = None
+                                st.session_state.last_split = (split_key, *build_split(
+                                    uploaded_file_split.getvalue(),
+                                    split_option,
+                                    ranges_list,
+                                    batch_size
+                                ))
+                            _, zip_buffer, pdf_files, split_stats = st.session_state.last_split
                             
-                            if not pdf_files:
+                            if not split_stats['files']:
                                 st.warning("⚠️ No se generaron archivos. Verifica los rangos.")
                                 return
                             
-                            st.success(f"✅ PDF dividido en {len(pdf_files)} archivos!")
+                            st.success(f"✅ PDF dividido en {split_stats['files']} archivos!")
                             
                             # Estadísticas
                             col1, col2, col3 = st.columns(3)
                             with col1:
-                                st.metric("Archivos generados", len(pdf_files))
+                                st.metric("Archivos generados", split_stats['files'])
                             with col2:
                                 if split_option == "todas":
                                     st.metric("Tipo", "Páginas individuales")
+                                elif split_option == "bloques":
+                                    st.metric("Tipo", f"Bloques de {batch_size} págs")
                                 else:
                                     st.metric("Tipo", "Rangos personalizados")
                             with col3:
-                                total_size = sum(len(pdf.getvalue()) for pdf in pdf_files) / 1024
+                                total_size = split_stats['size'] / 1024
                                 st.metric("Tamaño total", f"{total_size:.1f} KB")
                             
-                            # Descarga en ZIP
-                            if len(pdf_files) > 1:
-                                st.subheader("📦 Descarga múltiple")
-                                
-                                zip_buffer = io.BytesIO()
-                                with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                                    for i, pdf_buffer in enumerate(pdf_files):
-                                        if split_option == "todas":
-                                            filename = f"pagina_{i+1}.pdf"
-                                        else:
-                                            range_name = ranges_list[i] if i < len(ranges_list) else f"rango_{i+1}"
-                                            filename = f"rango_{range_name}.pdf".replace('-', '_')
-                                        
-                                        zip_file.writestr(filename, pdf_buffer.getvalue())
-                                
-                                zip_buffer.seek(0)
-                                zip_size = len(zip_buffer.getvalue()) / 1024
-                                
-                                st.download_button(
-                                    label=f"📥 Descargar todos como ZIP ({zip_size:.1f} KB)",
-                                    data=zip_buffer.getvalue(),
-                                    file_name="pdf_divididos.zip",
-                                    mime="application/zip",
-                                    type="primary"
-                                )
-                            
-                            # Descargas individuales
-                            st.subheader("📄 Descargas individuales")
-                            
-                            if split_option == "todas":
-                                pages_per_row = 6
-                                total_pages_display = len(pdf_files)
-                                
-                                for start_idx in range(0, total_pages_display, pages_per_row):
-                                    end_idx = min(start_idx + pages_per_row, total_pages_display)
-                                    cols = st.columns(pages_per_row)
-                                    
-                                    for i, pdf_buffer in enumerate(pdf_files[start_idx:end_idx]):
-                                        page_num = start_idx + i + 1
-                                        with cols[i]:
-                                            st.download_button(
-                                                label=f"Pág {page_num}",
-                                                data=pdf_buffer.getvalue(),
-                                                file_name=f"pagina_{page_num}.pdf",
-                                                mime="application/pdf",
-                                                key=f"page_{page_num}",
-                                                use_container_width=True
-                                            )
-                            else:
-                                cols = st.columns(2)
-                                for i, pdf_buffer in enumerate(pdf_files):
-                                    range_name = ranges_list[i] if i < len(ranges_list) else f"rango_{i+1}"
-                                    file_size = len(pdf_buffer.getvalue()) / 1024
-                                    
-                                    with cols[i % 2]:
-                                        st.download_button(
-                                            label=f"📑 {range_name} ({file_size:.1f} KB)",
-                                            data=pdf_buffer.getvalue(),
-                                            file_name=f"rango_{range_name}.pdf".replace('-', '_'),
-                                            mime="application/pdf",
-                                            key=f"range_{i}",
-                                            use_container_width=True
-                                        )
+                            render_split_downloads(zip_buffer, pdf_files, split_stats, split_option, batch_size, ranges_list, total_pages)
                     
                     except Exception as e:
                         st.error(f"❌ Error dividiendo PDF: {str(e)}")
@@ -742,6 +865,12 @@ def main():
             2. Selecciona "Dividir en páginas individuales"  
             3. Descarga un PDF por cada página
             
+            ### 🎯 **Dividir en bloques de páginas:**
+            1. Sube un archivo PDF
+            2. Selecciona "Dividir en bloques de páginas"
+            3. Indica cuántas páginas tendrá cada archivo
+            4. Descarga un PDF por cada bloque
+            
             ### 🎯 **Dividir por rangos personalizados:**
             1. Sube un archivo PDF
             2. Selecciona "Dividir por rangos personalizados"